@@ -0,0 +1,77 @@
+"""Compare formatting small cells one at a time against batched formatting.
+
+Usage: `python benchmarks/bench_batch.py [--cells N] [--target-version V]
+[notebook.ipynb ...]`
+
+Cells are only batched when target versions are pinned, so this uses
+`--target-version` (default `py310`).
+
+Exits non-zero if batching changes the output for any cell.
+"""
+
+import argparse
+import sys
+import time
+import typing as t
+from pathlib import Path
+
+import black
+
+from cells import notebook_cells, synthetic_cells
+
+from jupyter_black.jupyter_black import (
+    BATCH_SIZE,
+    _format_batch,
+    _format_source,
+)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("notebooks", nargs="*", type=Path)
+    parser.add_argument("--cells", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--target-version", default="py310")
+    args = parser.parse_args(argv)
+
+    if args.notebooks:
+        sources = [c for nb in args.notebooks for c in notebook_cells(nb)]
+    else:
+        sources = synthetic_cells(args.cells)
+    mode = black.Mode(
+        is_ipynb=True,
+        target_versions={black.TargetVersion[args.target_version.upper()]},
+    )
+
+    # Warm up black's lazy imports and caches so neither path pays for them
+    _format_source(sources[0], mode)
+
+    start = time.perf_counter()
+    per_cell = [_format_source(source, mode) for source in sources]
+    per_cell_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched: t.List[str] = []
+    for first in range(0, len(sources), args.batch_size):
+        last = first + args.batch_size
+        batched.extend(_format_batch(sources[first:last], mode))
+    batched_time = time.perf_counter() - start
+
+    mismatches = [
+        i for i, (a, b) in enumerate(zip(per_cell, batched)) if a != b
+    ]
+    print(f"cells:      {len(sources)}")
+    print(f"per cell:   {per_cell_time:.3f}s")
+    print(f"batched:    {batched_time:.3f}s")
+    print(f"speed-up:   {per_cell_time / batched_time:.2f}x")
+    print(f"mismatches: {len(mismatches)}")
+    for i in mismatches:
+        print(
+            f"--- cell {i} ---\n{per_cell[i]}\n+++ batched +++\n{batched[i]}"
+        )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Compare the engines `format_cells` can run black on in parallel.
+
+Usage: `python benchmarks/bench_engines.py [--cells N] [--workers N]`
+
+Subinterpreters need python 3.14+ and a black that loads in them; where
+they aren't supported that row reports the fallback engine instead.
+"""
+
+import argparse
+import sys
+import time
+import typing as t
+
+import black
+
+from cells import synthetic_cells
+
+from jupyter_black.jupyter_black import (
+    ENGINES,
+    BlackFormatter,
+    _make_executor,
+)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cells", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    sources = synthetic_cells(args.cells)
+    mode = black.Mode()
+
+    start = time.perf_counter()
+    expected = BlackFormatter(None, mode=mode).format_cells(sources)
+    serial = time.perf_counter() - start
+    print(f"{args.cells} cells, {args.workers} workers")
+    print(f"{'engine':>14} {'pool':>26} {'seconds':>8} {'speed-up':>9}")
+    print(f"{'serial':>14} {'-':>26} {serial:>8.2f} {1:>8.2f}x")
+
+    failed = False
+    for engine in ENGINES:
+        with _make_executor(engine, 1) as pool:
+            pool_type = type(pool).__name__
+
+        # A fresh formatter so that nothing is cached
+        formatter = BlackFormatter(None, mode=mode)
+        start = time.perf_counter()
+        result = formatter.format_cells(
+            sources, workers=args.workers, engine=engine
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"{engine:>14} {pool_type:>26} {elapsed:>8.2f} "
+            f"{serial / elapsed:>8.2f}x"
+        )
+        if result != expected:
+            print(f"{engine} output differs from serial formatting")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""Measure the aggregate cost of jupyter_black across many kernels.
+
+Starts N subprocess IPython shells, loads the extension in each via
+`jupyter_black.load()`, and replays an execution trace through the
+`pre_run_cell` event, which is the path `_format_cell` runs on. Cells are
+not executed, only formatted.
+
+Usage: `python benchmarks/bench_kernels.py [--kernels 1,4,16] [--passes 3]
+[--cells N | --trace notebook.ipynb ...] [--stages isort]`
+
+For each kernel count this reports:
+
+- RSS per kernel attributable to jupyter_black and black, i.e. growth from
+  before importing the extension to the end of the trace
+- total CPU seconds spent on the trace across all kernels
+- latency percentiles of the `pre_run_cell` path across all kernels
+- RSS per kernel freed by `BlackFormatter.release()`, i.e. what an idle
+  kernel gives back with `load(idle_timeout=...)`
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import typing as t
+from pathlib import Path
+
+from cells import notebook_cells, synthetic_cells
+
+
+def rss_bytes() -> int:
+    """Return the current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def run_kernel(
+    trace: t.List[str],
+    passes: int,
+    load_kwargs: t.Dict[str, t.Any],
+) -> t.Dict[str, t.Any]:
+    """Replay `trace` in a fresh IPython shell with jupyter_black loaded."""
+    from IPython.core.interactiveshell import (
+        ExecutionInfo,
+        InteractiveShell,
+    )
+
+    shell = InteractiveShell.instance()
+    rss_before = rss_bytes()
+
+    # Callbacks run in registration order, so these bracket the extension
+    started: t.List[float] = []
+    latencies: t.List[float] = []
+    shell.events.register(
+        "pre_run_cell", lambda info: started.append(time.perf_counter())
+    )
+
+    import jupyter_black
+
+    jupyter_black.load(ip=shell, verbosity="WARNING", **load_kwargs)
+    shell.events.register(
+        "pre_run_cell",
+        lambda info: latencies.append(time.perf_counter() - started[-1]),
+    )
+    rss_loaded = rss_bytes()
+
+    cpu_start = time.process_time()
+    for _ in range(passes):
+        for source in trace:
+            info = ExecutionInfo(
+                source,
+                store_history=True,
+                silent=False,
+                shell_futures=True,
+                cell_id=None,
+            )
+            shell.events.trigger("pre_run_cell", info)
+    cpu = time.process_time() - cpu_start
+    rss_total = rss_bytes()
+
+    # What the idle timeout would release
+    jupyter_black.jupyter_black.formatter.release()
+
+    return {
+        "rss_load": rss_loaded - rss_before,
+        "rss_total": rss_total - rss_before,
+        "rss_released": rss_total - rss_bytes(),
+        "cpu": cpu,
+        "latencies": latencies,
+    }
+
+
+def percentile(values: t.List[float], pct: float) -> float:
+    """Return the `pct` percentile of `values`."""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[
+        int(pct) - 1
+    ]
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--kernels", default="1,2,4,8")
+    parser.add_argument("--passes", type=int, default=1)
+    parser.add_argument("--cells", type=int, default=200)
+    parser.add_argument("--trace", nargs="*", type=Path, default=[])
+    parser.add_argument("--stages", nargs="*", default=[])
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        trace = [c for nb in args.trace for c in notebook_cells(nb)]
+    else:
+        trace = synthetic_cells(args.cells)
+    load_kwargs = {"interactive": True, "stages": args.stages}
+
+    print(f"{len(trace)} cells x {args.passes} passes per kernel")
+    header = (
+        f"{'kernels':>7} {'load MiB':>9} {'total MiB':>10} "
+        f"{'freed MiB':>10} {'CPU s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    )
+    print(header)
+
+    # Each kernel starts from a fresh interpreter, like a real kernel
+    ctx = multiprocessing.get_context("spawn")
+    for count in (int(n) for n in args.kernels.split(",")):
+        with ctx.Pool(count) as pool:
+            results = pool.starmap(
+                run_kernel, [(trace, args.passes, load_kwargs)] * count
+            )
+
+        mib = 1024 * 1024
+        load = statistics.mean(r["rss_load"] for r in results) / mib
+        total = statistics.mean(r["rss_total"] for r in results) / mib
+        freed = statistics.mean(r["rss_released"] for r in results) / mib
+        cpu = sum(r["cpu"] for r in results)
+        latencies = [ms * 1000 for r in results for ms in r["latencies"]]
+        print(
+            f"{count:>7} {load:>9.1f} {total:>10.1f} {freed:>10.2f} "
+            f"{cpu:>8.2f} "
+            f"{percentile(latencies, 50):>8.2f} "
+            f"{percentile(latencies, 95):>8.2f} "
+            f"{percentile(latencies, 99):>8.2f} "
+            f"{max(latencies):>8.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Measure how much formatting "Run All" leaves on the critical path.
+
+Starts a real kernel, loads the extension with and without `lookahead`, and
+sends every cell's execute request at once like a frontend's "Run All".
+Each cell also sleeps to stand in for the work it does, and errors (the
+synthetic cells use undefined names) don't abort the rest of the run.
+
+Usage: `python benchmarks/bench_lookahead.py [--cells N] [--sleep S]
+[notebook.ipynb ...]`
+
+For each mode this reports the wall time of the run, how many cells black
+formatted in the kernel's main thread rather than the look-ahead worker,
+and the total time `pre_run_cell` spent in the extension.
+"""
+
+import argparse
+import sys
+import time
+import typing as t
+from pathlib import Path
+
+from jupyter_client.manager import start_new_kernel
+
+from cells import notebook_cells, synthetic_cells
+
+# Records where black ran and how long the extension held up each cell
+SETUP = """
+import threading, time
+import jupyter_black, jupyter_black.jupyter_black as jbm
+
+_format_source = jbm._format_source
+_format_cell = jbm.BlackFormatter._format_cell
+inline = []
+latencies = []
+
+def _probe_format_source(*args, **kwargs):
+    inline.append(threading.current_thread() is threading.main_thread())
+    return _format_source(*args, **kwargs)
+
+def _probe_format_cell(self, info):
+    start = time.perf_counter()
+    _format_cell(self, info)
+    latencies.append(time.perf_counter() - start)
+
+jbm._format_source = _probe_format_source
+jbm.BlackFormatter._format_cell = _probe_format_cell
+jupyter_black.load(lookahead={lookahead}, interactive=True)
+"""
+
+REPORT = "print(sum(inline), sum(latencies[1:]))"
+
+
+def run_all(
+    sources: t.List[str],
+    sleep: float,
+    lookahead: bool,
+) -> t.Tuple[float, int, float]:
+    """Return wall time, inline formats and hook time for one run."""
+    km, kc = start_new_kernel(kernel_name="python3")
+    try:
+        kc.execute_interactive(SETUP.format(lookahead=lookahead), timeout=60)
+
+        start = time.perf_counter()
+        pending = {
+            kc.execute(
+                f"import time; time.sleep({sleep})\n{source}",
+                stop_on_error=False,
+            )
+            for source in sources
+        }
+        while pending:
+            reply = kc.get_shell_msg(timeout=60)
+            pending.discard(reply["parent_header"].get("msg_id"))
+        wall = time.perf_counter() - start
+
+        output: t.List[str] = []
+        kc.execute_interactive(
+            REPORT,
+            timeout=60,
+            output_hook=lambda msg: output.append(
+                msg["content"].get("text", "")
+            ),
+        )
+        inline, hook = "".join(output).split()
+        return wall, int(inline), float(hook)
+    finally:
+        kc.stop_channels()
+        km.shutdown_kernel(now=True)
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("notebooks", nargs="*", type=Path)
+    parser.add_argument("--cells", type=int, default=200)
+    parser.add_argument("--sleep", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    if args.notebooks:
+        sources = [c for nb in args.notebooks for c in notebook_cells(nb)]
+    else:
+        sources = synthetic_cells(args.cells)
+
+    print(f"{len(sources)} cells, {args.sleep}s each")
+    print(f"{'lookahead':>9} {'wall s':>8} {'inline':>7} {'hook ms':>8}")
+    for lookahead in (False, True):
+        wall, inline, hook = run_all(sources, args.sleep, lookahead)
+        print(f"{lookahead!s:>9} {wall:>8.2f} {inline:>7} {hook * 1000:>8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
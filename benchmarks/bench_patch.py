@@ -0,0 +1,102 @@
+"""Compare replacing whole cells against patching them with line edits.
+
+Builds large, already formatted cells from `CELLS`, makes a few of their
+lines unformatted, and formats them again. For each cell size this reports:
+
+- bytes sent for the whole cell, i.e. the `set_next_input` payload
+- bytes sent for the edit script through the comm
+- time to compute the edit script in the kernel
+- time to apply the edit script, in python as a stand-in for the frontend
+
+Usage: `python benchmarks/bench_patch.py [--lines 100,1000,2000]
+[--changed N] [--repeat N]`
+
+Exits non-zero if applying the edits doesn't reproduce the formatted cell.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import typing as t
+
+import black
+
+from cells import CELLS
+
+from jupyter_black.jupyter_black import (
+    _format_source,
+    apply_edits,
+    edit_script,
+)
+
+
+def large_cell(lines: int, changed: int, seed: int = 0) -> str:
+    """Return a cell of about `lines` lines with `changed` unformatted."""
+    rng = random.Random(seed)
+    body: t.List[str] = []
+    while len(body) < lines:
+        body.extend(
+            f"{rng.choice(CELLS)}\nn_{len(body)}={len(body)}".split("\n")
+        )
+    mode = black.Mode(is_ipynb=True)
+    body = _format_source("\n".join(body), mode).split("\n")
+    for i in rng.sample(range(len(body)), changed):
+        body[i] = body[i].replace(" = ", "=")
+    return "\n".join(body)
+
+
+def best_of(repeat: int, func: t.Callable[[], t.Any]) -> float:
+    """Return the fastest of `repeat` calls to `func`, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--lines", default="100,1000,2000")
+    parser.add_argument("--changed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    mode = black.Mode(is_ipynb=True)
+    print(
+        f"{'lines':>6} {'cell B':>9} {'edits B':>8} "
+        f"{'diff ms':>8} {'apply ms':>9}"
+    )
+    failures = 0
+    for lines in (int(n) for n in args.lines.split(",")):
+        source = large_cell(lines, args.changed)
+        formatted = _format_source(source, mode)
+        edits = edit_script(source, formatted)
+        if apply_edits(source, edits) != formatted:
+            failures += 1
+
+        # What each path puts on the wire, minus the message envelope
+        cell_bytes = len(
+            json.dumps({"text": formatted, "replace": True}).encode()
+        )
+        edit_bytes = len(
+            json.dumps({"cell_id": "x" * 36, "edits": edits}).encode()
+        )
+        diff_ms = best_of(args.repeat, lambda: edit_script(source, formatted))
+        apply_ms = best_of(args.repeat, lambda: apply_edits(source, edits))
+        print(
+            f"{len(source.splitlines()):>6} {cell_bytes:>9} {edit_bytes:>8} "
+            f"{diff_ms:>8.2f} {apply_ms:>9.3f}"
+        )
+    print(f"mismatches: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Synthetic notebook cells shared by the benchmarks."""
+
+import json
+import random
+import typing as t
+from pathlib import Path
+
+# A mix of the tiny cells that dominate typical notebooks, plus a few that
+# black has to handle specially (magics, semicolons, docstrings, comments)
+CELLS = [
+    "import os",
+    "import numpy as np\nimport pandas as pd",
+    "df=pd.read_csv('data.csv')",
+    "df.head()",
+    "x=[1,2,3]",
+    "print('hello')",
+    "def add(a,b):\n  return a+b",
+    "class Point:\n  x:int=0\n  y:int=0",
+    "for i in range(3):\n    print(i)",
+    "result = add(1,2);",
+    "%matplotlib inline",
+    "%%time\ntotal=sum(range(10))",
+    "'''Docstring'''\nvalue = 1",
+    "# setup\nconfig = {'a':1,'b':2}",
+    "values = {k:v for k,v in config.items()}",
+    "@decorator\ndef wrapped(): pass",
+    "try:\n  risky()\nexcept Exception as e:\n  print(e)",
+    "y = x  # trailing comment",
+    "z = f'{x!r}'",
+    "items = sorted(values, key=lambda k: values[k], reverse=True)",
+]
+
+
+def synthetic_cells(count: int, seed: int = 0) -> t.List[str]:
+    """Return `count` cells drawn from `CELLS`, many made unique."""
+    rng = random.Random(seed)
+    return [
+        f"{cell}\nn_{i}={i}" if rng.random() < 0.5 else cell
+        for i, cell in enumerate(rng.choices(CELLS, k=count))
+    ]
+
+
+def notebook_cells(path: Path) -> t.List[str]:
+    """Return the source of each code cell in a notebook."""
+    nb = json.loads(path.read_text())
+    return [
+        "".join(cell["source"])
+        for cell in nb["cells"]
+        if cell["cell_type"] == "code"
+    ]
@@ -5,12 +5,14 @@ __author__ = "Nathan Henrie"
 __email__ = "nate@n8henrie.com"
 
 from .jupyter_black import (
+    format_cells,
     load,
     load_ipython_extension,
     unload_ipython_extension,
 )
 
 __all__ = [
+    "format_cells",
     "load",
     "load_ipython_extension",
     "unload_ipython_extension",
@@ -0,0 +1,46 @@
+"""Command line entry point, e.g. `python -m jupyter_black --prewarm`."""
+
+import argparse
+import os
+import sys
+import typing as t
+
+from blib2to3 import pygram
+
+from .jupyter_black import _grammar_is_cached, prewarm
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> int:
+    """Run the command line interface."""
+    parser = argparse.ArgumentParser(prog="python -m jupyter_black")
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        help=(
+            "cache black's grammar tables next to its grammar files and warm "
+            "up formatting, e.g. while building a container image"
+        ),
+    )
+    args = parser.parse_args(argv)
+
+    if not args.prewarm:
+        parser.print_help()
+        return 2
+
+    cached = prewarm()
+    grammar_dir = os.path.dirname(pygram.__file__)
+    if not _grammar_is_cached():
+        print(
+            f"Unable to cache black's grammar tables in {grammar_dir}, run "
+            "this with write access to it",
+            file=sys.stderr,
+        )
+        return 1
+
+    status = "already cached" if cached else "cached"
+    print(f"Grammar tables {status} in {grammar_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
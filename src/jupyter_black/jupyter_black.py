@@ -1,27 +1,460 @@
 """Beautify jupyter cells using black."""
 
+import ast
+import ctypes
+import difflib
+import functools
+import gc
 import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
 import typing as t
+from collections import OrderedDict
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from dataclasses import replace
+from uuid import uuid4
 
 from IPython.core import getipython
 from IPython.core.interactiveshell import ExecutionInfo
 from IPython.terminal.interactiveshell import TerminalInteractiveShell as Ipt
 
 import black
+from blib2to3 import pygram
+from blib2to3.pgen2 import driver
+from black.handle_ipynb_magics import (
+    mask_cell,
+    put_trailing_semicolon_back,
+    remove_trailing_semicolon,
+    unmask_cell,
+    validate_cell,
+)
 
 logging.basicConfig()
 LOGGER = logging.getLogger("jupyter_black")
 
 formatter = None
 
+# Number of formatted cells to remember, keyed on source and mode
+CACHE_SIZE = 512
+
+# Number of cells to format with a single call to black in `format_cells`
+BATCH_SIZE = 64
+
+# Ways to run black on several cores in `format_cells`, see `_make_executor`
+ENGINES = ("subinterpreter", "process", "thread")
+
+# Comm target frontends open to receive line edits instead of whole cells
+COMM_TARGET = "jupyter_black"
+
+# Exercises black's lazily imported and initialized code paths
+PREWARM_CELL = """%%time
+import os
+
+def f(x,*args,**kwargs) -> None:
+    print(f'{x!r}', [a for a in args], {**kwargs});
+"""
+
+# A formatting step run on a cell's source before black
+Stage = t.Callable[[str, black.Mode], str]
+
+
+@functools.lru_cache()
+def _isort_config(line_length: int) -> t.Any:
+    import isort
+
+    return isort.Config(
+        settings_path=os.getcwd(),
+        profile="black",
+        line_length=line_length,
+    )
+
+
+def sort_imports(source: str, mode: black.Mode) -> str:
+    """Sort a cell's imports with isort's black profile.
+
+    IPython magics and trailing semicolons are handled the same way black
+    handles them, and any `[tool.isort]` settings in the project are
+    respected.
+    """
+    import isort
+
+    try:
+        validate_cell(source, mode)
+        stripped, has_semicolon = remove_trailing_semicolon(source)
+        masked, replacements = mask_cell(stripped)
+    except (black.NothingChanged, SyntaxError):
+        return source
+    sorted_source = isort.code(masked, config=_isort_config(mode.line_length))
+    unmasked = unmask_cell(sorted_source, replacements)
+    return put_trailing_semicolon_back(unmasked, has_semicolon)
+
+
+# Built-in stages that can be referred to by name
+STAGES: t.Dict[str, Stage] = {
+    "isort": sort_imports,
+}
+
+
+def _resolve_stages(
+    stages: t.Iterable[t.Union[str, Stage]],
+    mode: black.Mode,
+) -> t.Tuple[Stage, ...]:
+    """Look up stages given by name, failing early if unavailable."""
+    resolved = []
+    for stage in stages:
+        if isinstance(stage, str):
+            try:
+                stage = STAGES[stage]
+            except KeyError:
+                raise ValueError(
+                    f"Unknown formatting stage: {stage}"
+                ) from None
+        if stage is sort_imports:
+            try:
+                _isort_config(mode.line_length)
+            except ImportError as e:
+                msg = "Sorting imports requires `jupyter-black[isort]`"
+                raise ImportError(msg) from e
+        resolved.append(stage)
+    return tuple(resolved)
+
+
+def _apply_stages(
+    source: str, mode: black.Mode, stages: t.Sequence[Stage]
+) -> str:
+    """Run each stage on the output of the previous one."""
+    for stage in stages:
+        try:
+            source = stage(source, mode)
+        except Exception as e:
+            LOGGER.debug("Stage %s failed: %s", stage.__name__, e)
+    return source
+
+
+def _format_source(
+    source: str,
+    mode: black.Mode,
+    stages: t.Sequence[Stage] = (),
+) -> str:
+    """Format a single cell, returning it unchanged if black can't or won't.
+
+    This is a module-level function so that it can be sent to worker
+    processes.
+    """
+    source = _apply_stages(source, mode, stages)
+    try:
+        # `fast=False` seems to make *at most* a few ns difference even on
+        # medium size cells and seems to help ensure correctness
+        return black.format_cell(source, mode=mode, fast=False)
+    except black.NothingChanged:
+        pass
+    except Exception as e:
+        LOGGER.debug(e)
+    return source
+
+
+def _can_batch(source: str, mode: black.Mode) -> bool:
+    """Return whether a cell formats identically inside a combined module.
+
+    Only plain python cells qualify: black treats cells with magics,
+    trailing semicolons, leading docstrings, `fmt:` directives or trailing
+    comments differently when they aren't at the start or end of a file.
+
+    Nothing is batched unless the mode pins target versions, since black
+    would otherwise infer them from syntax used anywhere in the batch and
+    format each cell for the versions all of them support.
+    """
+    if not mode.target_versions:
+        return False
+    if not source.strip() or "\r" in source or "\f" in source:
+        return False
+    if "fmt:" in source or "yapf:" in source or "__future__" in source:
+        return False
+    if source.rstrip().splitlines()[-1].lstrip().startswith("#"):
+        return False
+    try:
+        validate_cell(source, mode)
+        tree = ast.parse(source)
+    except (black.NothingChanged, SyntaxError, ValueError):
+        return False
+    if remove_trailing_semicolon(source)[1]:
+        return False
+    first = tree.body[0] if tree.body else None
+    return not (
+        isinstance(first, ast.Expr)
+        and isinstance(first.value, (ast.Constant, ast.JoinedStr))
+    )
+
+
+def _format_batch(
+    sources: t.Sequence[str],
+    mode: black.Mode,
+    stages: t.Sequence[Stage] = (),
+) -> t.List[str]:
+    """Format many small cells with a single call to black.
+
+    Eligible cells are joined into one module, separated by a unique comment,
+    which is formatted and split back apart. Black's fixed per-call costs
+    (and the stability and equivalence check) are then paid once for the
+    batch instead of for every cell. Ineligible cells, or all cells if
+    anything looks off, are formatted one at a time instead.
+    """
+    sources = [_apply_stages(source, mode, stages) for source in sources]
+    results = list(sources)
+    batch = [i for i, src in enumerate(sources) if _can_batch(src, mode)]
+    if len(batch) > 1:
+        sentinel = f"# jupyter-black-cell-{uuid4().hex}"
+        combined = f"\n{sentinel}\n".join(
+            _strip_leading_blank_lines(sources[i]).rstrip("\n") for i in batch
+        )
+        try:
+            dst = black.format_str(combined, mode=mode)
+            black.check_stability_and_equivalence(combined, dst, mode=mode)
+        except Exception as e:
+            LOGGER.debug("Unable to format batch: %s", e)
+        else:
+            chunks = re.split(
+                rf"^{re.escape(sentinel)}\n", dst, flags=re.MULTILINE
+            )
+            if len(chunks) == len(batch):
+                for i, chunk in zip(batch, chunks):
+                    results[i] = chunk.rstrip("\n")
+                batched = set(batch)
+                return [
+                    results[i] if i in batched else _format_source(src, mode)
+                    for i, src in enumerate(sources)
+                ]
+            LOGGER.debug("Batch didn't split cleanly, formatting per cell")
+
+    return [_format_source(src, mode) for src in sources]
+
+
+def _strip_leading_blank_lines(source: str) -> str:
+    """Drop leading blank lines, which black would remove from a cell."""
+    lines = source.splitlines(keepends=True)
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    return "".join(lines)
+
+
+@functools.lru_cache()
+def _subinterpreters_supported() -> bool:
+    """Check whether black can run in a pool of subinterpreters.
+
+    `InterpreterPoolExecutor` is new in python 3.14, and extension modules
+    (including black's mypyc-compiled ones) may refuse to load in a
+    subinterpreter with its own GIL, so try formatting a cell in one.
+    """
+    try:
+        from concurrent.futures import (  # type: ignore[attr-defined]
+            InterpreterPoolExecutor,
+        )
+    except ImportError:
+        return False
+
+    try:
+        with InterpreterPoolExecutor(max_workers=1) as pool:
+            pool.submit(_format_batch, ["x=1"], black.Mode()).result()
+    except Exception as e:
+        LOGGER.debug("Subinterpreters unavailable: %s", e)
+        return False
+    return True
+
+
+def _make_executor(engine: str, workers: int) -> Executor:
+    """Return a pool of `workers` for the requested engine.
+
+    `"auto"` prefers subinterpreters, which run black in parallel without
+    forking the kernel or duplicating it in memory, and falls back to
+    processes where they aren't supported. Processes are spawned rather than
+    forked, since forking a kernel with other threads running (zmq, the
+    look-ahead worker, ...) can deadlock the child.
+    """
+    if engine in ("auto", "subinterpreter"):
+        if _subinterpreters_supported():
+            from concurrent.futures import (  # type: ignore[attr-defined]
+                InterpreterPoolExecutor,
+            )
+
+            return InterpreterPoolExecutor(max_workers=workers)
+        if engine == "subinterpreter":
+            LOGGER.info("Subinterpreters unavailable, using processes")
+        engine = "process"
+
+    if engine == "thread":
+        return ThreadPoolExecutor(max_workers=workers)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def _release_black_caches() -> None:
+    """Free memory held by black's internal caches.
+
+    Black's grammar tables are left alone since its modules hold references
+    to them; everything released here is rebuilt on demand.
+    """
+    for name, module in list(sys.modules.items()):
+        if name.split(".")[0] not in ("black", "blib2to3"):
+            continue
+        for obj in list(vars(module).values()):
+            cache_clear = getattr(obj, "cache_clear", None)
+            if callable(cache_clear):
+                cache_clear()
+    gc.collect()
+
+    # Return freed heap pages to the OS, otherwise RSS doesn't shrink
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+Edit = t.Tuple[int, int, t.List[str]]
+
+
+def edit_script(old: str, new: str) -> t.List[Edit]:
+    """Return the line edits that turn `old` into `new`.
+
+    Each edit `(start, end, lines)` replaces lines `start` up to `end` of
+    `old` with `lines`, where lines are split on newlines. Edits are ordered
+    and refer to `old`, so apply them from last to first, see `apply_edits`.
+    """
+    old_lines = old.split("\n")
+    new_lines = new.split("\n")
+
+    # Black usually touches a few lines of a cell, so only diff the part
+    # between the unchanged head and tail
+    head = 0
+    for a, b in zip(old_lines, new_lines):
+        if a != b:
+            break
+        head += 1
+    tail = 0
+    limit = min(len(old_lines), len(new_lines)) - head
+    while tail < limit and old_lines[-1 - tail] == new_lines[-1 - tail]:
+        tail += 1
+    old_stop = len(old_lines) - tail
+    new_stop = len(new_lines) - tail
+    old_mid = old_lines[head:old_stop]
+    new_mid = new_lines[head:new_stop]
+
+    matcher = difflib.SequenceMatcher(None, old_mid, new_mid)
+    return [
+        (head + i1, head + i2, new_mid[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_edits(old: str, edits: t.Iterable[Edit]) -> str:
+    """Apply the edits from `edit_script` to `old`."""
+    lines = old.split("\n")
+    for start, end, new_lines in reversed(list(edits)):
+        lines[start:end] = new_lines
+    return "\n".join(lines)
+
+
+class _Cache:
+    """Thread-safe LRU mapping of `(source, mode)` to the formatted source."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._data: "OrderedDict[t.Hashable, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: t.Hashable) -> t.Optional[str]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: t.Hashable, value: str) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+def _grammar_pickles() -> t.List[t.Tuple[str, str]]:
+    """Return black's grammar files and where their tables are pickled."""
+    grammar_dir = os.path.dirname(pygram.__file__)
+    sources = [
+        os.path.join(grammar_dir, name)
+        for name in ("Grammar.txt", "PatternGrammar.txt")
+    ]
+    return [
+        (source, driver._generate_pickle_name(source)) for source in sources
+    ]
+
+
+def _grammar_is_cached() -> bool:
+    """Check for up-to-date, readable pickles of black's grammar tables.
+
+    `import black` only looks for them next to black's own grammar files,
+    and regenerates the tables if they're missing, stale or unreadable.
+    """
+    return all(
+        driver._newer(pickle, source) and os.access(pickle, os.R_OK)
+        for source, pickle in _grammar_pickles()
+    )
+
+
+def prewarm() -> bool:
+    """Cache black's grammar tables and warm up the formatting code path.
+
+    Meant to be run once while building an image, so that kernels started
+    from it don't pay these costs on every start and their first formatted
+    cell. The tables are stored next to black's grammar files, which is the
+    only place `import black` looks, so that directory must be writable.
+
+    Returns:
+        Whether the grammar tables were already cached
+    """
+    cached = _grammar_is_cached()
+    for source, pickle in _grammar_pickles():
+        if not cached:
+            driver.load_grammar(source, pickle)
+
+        # Black writes the pickles readable only by their owner, e.g. root
+        # while building an image, but kernels may run as another user
+        try:
+            os.chmod(pickle, 0o644)
+        except OSError as e:
+            LOGGER.debug(e)
+    _format_source(PREWARM_CELL, black.Mode(is_ipynb=True))
+    return cached
+
 
 class BlackFormatter:
     """Formatter that stores config and call `black.format_cell`."""
 
     def __init__(
         self,
-        ip: Ipt,
-        black_config: t.Optional[t.Dict[str, str]] = None,
+        ip: t.Optional[Ipt],
+        black_config: t.Optional[t.Dict[str, t.Any]] = None,
+        interactive: t.Optional[bool] = None,
+        mode: t.Optional[black.Mode] = None,
+        stages: t.Iterable[t.Union[str, Stage]] = (),
+        prewarm: bool = False,
+        idle_timeout: t.Optional[float] = None,
     ) -> None:
         """Initialize the class with the passed in config.
 
@@ -38,15 +471,92 @@ class BlackFormatter:
                 https://github.com/ipython/ipython/blob/77e188547e5705a0e960551519a851ac45db8bfc/IPython/core/display_functions.py#L88  # noqa
 
         Arguments:
-            ip: ipython shell
+            ip: ipython shell, or `None` if only formatting via `format_cells`
             black_config: Dictionary for black config options
+            interactive: Whether cells are being run by a person who will see
+                the formatted result; `None` to detect this for each cell
+            mode: A `black.Mode` to use instead of reading `pyproject.toml`
+                and `black_config`
+            stages: Formatting steps to run in order before black, either
+                callables or names from `STAGES` (e.g. `"isort"`)
+            prewarm: Format a sample cell in the background so that the
+                first real cell doesn't pay for black's lazy initialization
+            idle_timeout: Seconds without `pre_run_cell` events after which
+                cached results and black's caches are released, see
+                `release`; `None` to never release them
         """
         self.shell = ip
+        self._cache = _Cache()
+        self._idle_lock = threading.Lock()
+        self._idle_timer: t.Optional[threading.Timer] = None
+        self._last_used = time.monotonic()
+        self._comms: t.Dict[str, t.Any] = {}
+        self._lookahead: t.Dict[t.Hashable, "Future[str]"] = {}
+        self._lookahead_lock = threading.Lock()
+        self._lookahead_executor: t.Optional[ThreadPoolExecutor] = None
+        self._shell_stream: t.Optional[t.Tuple[t.Any, t.Any, t.Any]] = None
+        self._pending_kernel: t.Any = None
+        self.configure(
+            black_config,
+            interactive=interactive,
+            mode=mode,
+            stages=stages,
+            idle_timeout=idle_timeout,
+        )
+
+        if prewarm:
+            threading.Thread(
+                target=_format_source,
+                args=(PREWARM_CELL, self.mode),
+                daemon=True,
+            ).start()
+
+    @property
+    def mode(self) -> black.Mode:
+        """The `black.Mode` cells are formatted with."""
+        return self._settings[0]
 
+    @property
+    def stages(self) -> t.Tuple[Stage, ...]:
+        """Formatting steps run on each cell before black."""
+        return self._settings[1]
+
+    def configure(
+        self,
+        black_config: t.Optional[t.Dict[str, t.Any]] = None,
+        interactive: t.Optional[bool] = None,
+        mode: t.Optional[black.Mode] = None,
+        stages: t.Iterable[t.Union[str, Stage]] = (),
+        idle_timeout: t.Optional[float] = None,
+    ) -> None:
+        """Replace the formatter's config, e.g. when `load` is called again.
+
+        The mode and stages are swapped in together, so a cell is never
+        formatted with a mix of old and new config. Cached results are keyed
+        on both, so they're kept in case a later call switches back.
+
+        Arguments are the same as for `__init__`.
+        """
+        if mode is not None:
+            mode = replace(mode, is_ipynb=True)
+        else:
+            mode = self._mode_from_config(black_config)
+        settings = (mode, _resolve_stages(stages, mode))
+
+        self.interactive = interactive
+        self._settings = settings
+        self._set_idle_timeout(idle_timeout)
+
+    @classmethod
+    def _mode_from_config(
+        cls,
+        black_config: t.Optional[t.Dict[str, t.Any]] = None,
+    ) -> black.Mode:
+        """Return a `black.Mode` from pyproject.toml and passed-in config."""
         if black_config is None:
             black_config = {}
 
-        mode_config = self._mode_config_from_pyproject_toml()
+        mode_config = cls._mode_config_from_pyproject_toml()
 
         tv = mode_config.pop("target_version", None)
         if tv is not None:
@@ -59,7 +569,7 @@ class BlackFormatter:
         LOGGER.debug("config: %s", mode_config)
         mode = black.Mode(**mode_config)
         mode.is_ipynb = True
-        self.mode = mode
+        return mode
 
     @staticmethod
     def _mode_config_from_pyproject_toml() -> t.Dict[str, t.Any]:
@@ -73,22 +583,338 @@ class BlackFormatter:
         valid_options = set(t.get_type_hints(black.Mode))
         return {k: v for k, v in config.items() if k in valid_options}
 
-    def _format_cell(self, cell_info: ExecutionInfo) -> None:
-        cell_content = str(cell_info.raw_cell)
+    def _is_interactive(self, cell_info: ExecutionInfo) -> bool:
+        """Guess whether anyone will ever see the reformatted cell.
 
-        try:
-            # `fast=False` seems to make *at most* a few ns difference even on
-            # medium size cells and seems to help ensure correctness
-            formatted_code = black.format_cell(
-                cell_content, mode=self.mode, fast=False
+        Headless runners like papermill and nbclient execute cells without
+        allowing stdin, and programmatic `run_cell` calls (and silent cells
+        from `%run`) don't store history; formatting these cells is wasted
+        work since the replacement payload is discarded.
+        """
+        if self.interactive is not None:
+            return self.interactive
+
+        if not cell_info.store_history:
+            return False
+
+        kernel = getattr(self.shell, "kernel", None)
+        if kernel is None:
+            return True
+        return bool(getattr(kernel, "_allow_stdin", True))
+
+    def format(self, source: str) -> str:
+        """Return the formatted source of a single cell.
+
+        Cells that are invalid or already formatted are returned unchanged.
+        """
+        return self._format(source, self._settings)
+
+    def _format(
+        self,
+        source: str,
+        settings: t.Tuple[black.Mode, t.Tuple[Stage, ...]],
+    ) -> str:
+        key = (source, *settings)
+        formatted = self._cache.get(key)
+        if formatted is None:
+            formatted = _format_source(source, *settings)
+            self._cache.set(key, formatted)
+        return formatted
+
+    def format_cells(
+        self,
+        sources: t.Iterable[str],
+        workers: t.Optional[int] = None,
+        engine: str = "auto",
+    ) -> t.List[str]:
+        """Return the formatted source of many cells.
+
+        Duplicate and previously formatted cells are only formatted once.
+
+        Arguments:
+            sources: source code of each cell
+            workers: format in a pool of this many workers; `None` or `1`
+                formats in the current thread
+            engine: what the pool is made of, one of `ENGINES` or `"auto"`
+                for subinterpreters where supported and processes elsewhere
+        """
+        if engine not in ("auto", *ENGINES):
+            raise ValueError(f"Unknown engine: {engine}")
+
+        sources = list(sources)
+        settings = self._settings
+        mode, stages = settings
+
+        # Results are collected here rather than read back from the cache,
+        # which only holds `CACHE_SIZE` cells
+        formatted: t.Dict[str, str] = {}
+        todo = []
+        for source in dict.fromkeys(sources):
+            cached = self._cache.get((source, *settings))
+            if cached is None:
+                todo.append(source)
+            else:
+                formatted[source] = cached
+
+        # Small cells are formatted in batches to amortize black's overhead
+        batches = []
+        for start in range(0, len(todo), BATCH_SIZE):
+            stop = start + BATCH_SIZE
+            batches.append(todo[start:stop])
+
+        if workers is not None and workers > 1 and len(batches) > 1:
+            with _make_executor(engine, workers) as pool:
+                modes = [mode] * len(batches)
+                all_stages = [stages] * len(batches)
+                results = pool.map(_format_batch, batches, modes, all_stages)
+                self._remember(batches, results, settings, formatted)
+        else:
+            results = (_format_batch(batch, mode, stages) for batch in batches)
+            self._remember(batches, results, settings, formatted)
+        return [formatted[source] for source in sources]
+
+    def _remember(
+        self,
+        batches: t.Iterable[t.Sequence[str]],
+        results: t.Iterable[t.Sequence[str]],
+        settings: t.Tuple[black.Mode, t.Tuple[Stage, ...]],
+        formatted: t.Dict[str, str],
+    ) -> None:
+        for sources, batch_results in zip(batches, results):
+            for source, dst in zip(sources, batch_results):
+                self._cache.set((source, *settings), dst)
+                formatted[source] = dst
+
+    def release(self) -> None:
+        """Free cached results and black's caches to reduce memory use.
+
+        They are transparently rebuilt the next time a cell is formatted.
+        """
+        LOGGER.debug("Releasing caches")
+        self._cache.clear()
+        _release_black_caches()
+
+    def _set_idle_timeout(self, idle_timeout: t.Optional[float]) -> None:
+        # A pending idle check is rescheduled with the new timeout on the
+        # next cell, or dropped if there no longer is one
+        with self._idle_lock:
+            self.idle_timeout = idle_timeout
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+
+    def _touch(self) -> None:
+        """Record activity, scheduling an idle check if there's a timeout."""
+        with self._idle_lock:
+            self._last_used = time.monotonic()
+            if self.idle_timeout is not None and self._idle_timer is None:
+                self._schedule_idle_check(self.idle_timeout)
+
+    def _schedule_idle_check(self, delay: float) -> None:
+        # Only one timer is pending at a time, not one per cell
+        self._idle_timer = threading.Timer(delay, self._check_idle)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _check_idle(self) -> None:
+        with self._idle_lock:
+            self._idle_timer = None
+            if self.idle_timeout is None:
+                return
+            idle = time.monotonic() - self._last_used
+            if idle < self.idle_timeout:
+                self._schedule_idle_check(self.idle_timeout - idle)
+                return
+        self.release()
+
+    def _open_comm(self, comm: t.Any, msg: t.Dict[str, t.Any]) -> None:
+        """Accept a comm from a frontend that can patch cells in place.
+
+        Comms are kept per session so that edits only go to the frontend
+        that ran the cell.
+        """
+        session = msg["header"]["session"]
+        LOGGER.debug("Opened comm for session %s", session)
+        self._comms[session] = comm
+
+        def on_close(msg: t.Dict[str, t.Any]) -> None:
+            if self._comms.get(session) is comm:
+                del self._comms[session]
+
+        comm.on_close(on_close)
+
+    def _send_edits(
+        self,
+        cell_info: ExecutionInfo,
+        old: str,
+        new: str,
+    ) -> bool:
+        """Send the cell's edits to its frontend, if it opened a comm.
+
+        Returns whether the edits were sent.
+        """
+        cell_id = getattr(cell_info, "cell_id", None)
+        parent = getattr(self.shell, "parent_header", None) or {}
+        comm = self._comms.get(parent.get("header", {}).get("session"))
+        if cell_id is None or comm is None:
+            return False
+
+        comm.send({"cell_id": cell_id, "edits": edit_script(old, new)})
+        return True
+
+    def _watch_requests(self, kernel: t.Any, defer: bool = True) -> None:
+        """Pre-format the code of queued execute requests in the background.
+
+        When running all cells, the frontend sends every execute request at
+        once. The kernel's shell stream callback is wrapped to peek at each
+        request as it arrives, and its code is formatted in a worker thread
+        while earlier cells run, so `pre_run_cell` finds it in the cache.
+
+        Extensions and startup files are loaded before the kernel sets that
+        callback, in which case wrapping it is deferred to the first cell
+        unless `defer` is `False`.
+        """
+        self._pending_kernel = None
+        if self._shell_stream is not None:
+            return
+
+        stream: t.Any = getattr(kernel, "shell_stream", None)
+        session = getattr(kernel, "session", None)
+        callback = getattr(stream, "_recv_callback", None)
+        if callback is None and stream is not None and defer:
+            self._pending_kernel = kernel
+            return
+        if callback is None or session is None:
+            LOGGER.warning("Look-ahead formatting isn't supported here")
+            return
+
+        def peek(msg: t.List[t.Any]) -> t.Any:
+            try:
+                self._peek(session, msg)
+            except Exception:
+                LOGGER.debug("Couldn't peek at message", exc_info=True)
+            return callback(msg)
+
+        if self._lookahead_executor is None:
+            self._lookahead_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="jupyter_black"
             )
-        except black.NothingChanged:
+        self._shell_stream = (stream, callback, peek)
+        stream._recv_callback = peek
+
+    def _unwatch_requests(self) -> None:
+        """Stop pre-formatting queued execute requests."""
+        self._pending_kernel = None
+        if self._shell_stream is not None:
+            stream, callback, peek = self._shell_stream
+            if stream._recv_callback is peek:
+                stream._recv_callback = callback
+            self._shell_stream = None
+        if self._lookahead_executor is not None:
+            # `shutdown(cancel_futures=True)` needs python 3.9
+            with self._lookahead_lock:
+                futures = list(self._lookahead.values())
+            for future in futures:
+                future.cancel()
+            self._lookahead_executor.shutdown(wait=False)
+            self._lookahead_executor = None
+
+    def _peek(self, session: t.Any, msg: t.List[t.Any]) -> None:
+        """Queue the code of an execute request for formatting."""
+        # Only the header and content are unpacked; the message is left for
+        # the kernel to validate and record
+        _, frames = session.feed_identities(msg, copy=False)
+        request = session.deserialize(frames, content=False, copy=False)
+        if request["header"]["msg_type"] != "execute_request":
             return
-        except Exception as e:
-            LOGGER.debug(e)
+        content = session.unpack(request["content"])
+
+        # Same checks as `_is_interactive`, before the cell's turn comes
+        if self.interactive is False:
+            return
+        if self.interactive is None and not (
+            content.get("store_history", True)
+            and not content.get("silent", False)
+            and content.get("allow_stdin", False)
+        ):
             return
 
-        self.shell.set_next_input(formatted_code, replace=True)
+        settings = self._settings
+        key = (content["code"], *settings)
+        executor = self._lookahead_executor
+        with self._lookahead_lock:
+            if executor is None or key in self._lookahead:
+                return
+            if self._cache.get(key) is not None:
+                return
+            future = executor.submit(self._format, content["code"], settings)
+            self._lookahead[key] = future
+
+        def done(future: "Future[str]") -> None:
+            with self._lookahead_lock:
+                self._lookahead.pop(key, None)
+
+        future.add_done_callback(done)
+
+    def _format_cell(self, cell_info: ExecutionInfo) -> None:
+        self._touch()
+        if self.shell is None:
+            return
+
+        if self._pending_kernel is not None:
+            self._watch_requests(self._pending_kernel, defer=False)
+
+        if not self._is_interactive(cell_info):
+            LOGGER.debug("Skipping formatting in non-interactive context")
+            return
+
+        cell_content = str(cell_info.raw_cell)
+        settings = self._settings
+
+        # Wait for the look-ahead worker if it's already formatting this
+        # cell, otherwise format it here rather than behind queued cells
+        with self._lookahead_lock:
+            future = self._lookahead.get((cell_content, *settings))
+        if future is not None and not future.cancel():
+            future.result()
+
+        formatted_code = self._format(cell_content, settings)
+        if formatted_code == cell_content:
+            return
+
+        # Frontends that can't patch cells get the whole cell instead
+        if not self._send_edits(cell_info, cell_content, formatted_code):
+            self.shell.set_next_input(formatted_code, replace=True)
+
+
+def format_cells(
+    sources: t.Iterable[str],
+    mode: t.Optional[black.Mode] = None,
+    workers: t.Optional[int] = None,
+    stages: t.Iterable[t.Union[str, Stage]] = (),
+    engine: str = "auto",
+) -> t.List[str]:
+    """Format the source of many cells at once.
+
+    Cells that are invalid or already formatted are returned unchanged.
+
+    Arguments:
+        sources: source code of each cell
+        mode: `black.Mode` to format with; defaults to the config of the
+            loaded extension, or else to `pyproject.toml` if available
+        workers: format in a pool of this many workers; `None` or `1`
+            formats in the current thread
+        stages: formatting steps to run before black, e.g. `["isort"]`;
+            must be picklable when using `workers`
+        engine: `"subinterpreter"`, `"process"` or `"thread"` pool, or
+            `"auto"` for subinterpreters where supported (python 3.14+)
+    """
+    stages = tuple(stages)
+    if mode is None and not stages and formatter is not None:
+        fmt = formatter
+    else:
+        fmt = BlackFormatter(None, mode=mode, stages=stages)
+    return fmt.format_cells(sources, workers=workers, engine=engine)
 
 
 def load_ipython_extension(
@@ -106,17 +932,37 @@ def load(
     line_length: t.Optional[int] = None,
     target_version: t.Optional[black.TargetVersion] = None,
     verbosity: t.Union[int, str] = logging.INFO,
+    interactive: t.Optional[bool] = None,
+    stages: t.Iterable[t.Union[str, Stage]] = (),
+    prewarm: bool = False,
+    idle_timeout: t.Optional[float] = None,
+    lookahead: bool = False,
     **black_config: t.Any,
 ) -> None:
     """Load the extension via `jupyter_black.load`.
 
-    This allows passing in custom configuration.
+    This allows passing in custom configuration. Calling it again replaces
+    the whole configuration of the already loaded extension: options that
+    aren't passed again go back to their defaults, e.g. a bare `load()`
+    turns off `stages` and `lookahead` set by a startup file. `prewarm` only
+    applies the first time.
 
     Arguments:
         ip: iPython interpreter -- you should be able to ignore this
         line_length: preferred line length
         target_version: preferred python version
         verbosity: logging verbosity
+        interactive: `False` to never format (e.g. for batch execution),
+            `True` to always format, or `None` (the default) to skip
+            formatting when running headless under papermill / nbclient
+        stages: formatting steps to run before black in a single pass, e.g.
+            `["isort"]` to also sort imports
+        prewarm: warm up black in the background so the first formatted
+            cell is as fast as the rest
+        idle_timeout: release memory held by black and cached results after
+            this many seconds without running a cell
+        lookahead: format queued cells in the background while earlier
+            cells run, e.g. after "Run All"
         **black_config: Other arguments you want to pass to black. See:
             https://github.com/psf/black/blob/911470a610e47d9da5ea938b0887c3df62819b85/src/black/mode.py#L99
     """
@@ -135,8 +981,47 @@ def load(
         black_config.update({"target_versions": set([target_version])})
 
     if formatter is None:
-        formatter = BlackFormatter(ip, black_config=black_config)
-    ip.events.register("pre_run_cell", formatter._format_cell)  # type: ignore
+        if not _grammar_is_cached():
+            LOGGER.info(
+                "Missed warm start: black regenerated its grammar tables on "
+                "import, consider `python -m jupyter_black --prewarm`"
+            )
+        formatter = BlackFormatter(
+            ip,
+            black_config=black_config,
+            interactive=interactive,
+            stages=stages,
+            prewarm=prewarm,
+            idle_timeout=idle_timeout,
+        )
+    else:
+        # Calling `load` again (e.g. from a startup file and a notebook)
+        # replaces the config rather than adding a second hook
+        if prewarm:
+            LOGGER.warning("jupyter_black is already loaded, ignoring prewarm")
+        formatter.configure(
+            black_config,
+            interactive=interactive,
+            stages=stages,
+            idle_timeout=idle_timeout,
+        )
+
+    callbacks = ip.events.callbacks["pre_run_cell"]
+    if formatter._format_cell not in callbacks:
+        ip.events.register(  # type: ignore
+            "pre_run_cell", formatter._format_cell
+        )
+    formatter.shell = ip
+
+    kernel = getattr(ip, "kernel", None)
+    comm_manager = getattr(kernel, "comm_manager", None)
+    if comm_manager is not None:
+        comm_manager.register_target(COMM_TARGET, formatter._open_comm)
+
+    if lookahead:
+        formatter._watch_requests(kernel)
+    else:
+        formatter._unwatch_requests()
 
 
 def unload_ipython_extension(ip: Ipt) -> None:
@@ -149,4 +1034,11 @@ def unload_ipython_extension(ip: Ipt) -> None:
         ip.events.unregister(  # type: ignore
             "pre_run_cell", formatter._format_cell
         )
+        comm_manager = getattr(
+            getattr(ip, "kernel", None), "comm_manager", None
+        )
+        if comm_manager is not None:
+            comm_manager.targets.pop(COMM_TARGET, None)
+        formatter._unwatch_requests()
+        formatter._set_idle_timeout(None)
         formatter = None
@@ -0,0 +1,68 @@
+"""Format notebooks with black as an nbconvert preprocessing stage.
+
+Requires `nbconvert`, e.g. `pip install jupyter-black[nbconvert]`:
+
+```console
+$ jupyter nbconvert --to html \
+    --Exporter.preprocessors=jupyter_black.preprocessor.BlackPreprocessor \
+    notebook.ipynb
+```
+"""
+
+import typing as t
+
+from nbconvert.preprocessors import Preprocessor
+from nbformat import NotebookNode
+from traitlets import Dict, Enum, Int, List, Unicode
+
+from .jupyter_black import ENGINES, BlackFormatter
+
+
+class BlackPreprocessor(Preprocessor):
+    """Format all code cells of a notebook with black."""
+
+    black_config = Dict(
+        help="Options passed to `black.Mode`, overriding pyproject.toml",
+    ).tag(config=True)
+
+    stages = List(
+        Unicode(),
+        help="Formatting stages to run before black, e.g. ['isort']",
+    ).tag(config=True)
+
+    workers = Int(
+        None,
+        allow_none=True,
+        help="Format cells in a pool of this many workers",
+    ).tag(config=True)
+
+    engine = Enum(
+        ("auto", *ENGINES),
+        default_value="auto",
+        help="Pool used with `workers`; subinterpreters where supported",
+    ).tag(config=True)
+
+    def preprocess(
+        self,
+        nb: NotebookNode,
+        resources: t.Dict[str, t.Any],
+    ) -> t.Tuple[NotebookNode, t.Dict[str, t.Any]]:
+        """Format every code cell at once instead of cell by cell."""
+        language = nb.metadata.get("language_info", {}).get("name", "python")
+        if language != "python":
+            return nb, resources
+
+        cells = [cell for cell in nb.cells if cell.cell_type == "code"]
+        formatter = BlackFormatter(
+            None,
+            black_config=dict(self.black_config),
+            stages=self.stages,
+        )
+        sources = formatter.format_cells(
+            (cell.source for cell in cells),
+            workers=self.workers,
+            engine=self.engine,
+        )
+        for cell, source in zip(cells, sources):
+            cell.source = source
+        return nb, resources
@@ -0,0 +1,382 @@
+"""Tests for `BlackFormatter` that don't require a running jupyter server."""
+
+import os
+import shutil
+import time
+import typing as t
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from IPython.core.events import EventManager, available_events
+from IPython.core.interactiveshell import ExecutionInfo
+
+import pytest
+
+import black
+from blib2to3 import pygram
+
+from jupyter_black import format_cells, load, unload_ipython_extension
+from jupyter_black.__main__ import main
+from jupyter_black.jupyter_black import (
+    BATCH_SIZE,
+    ENGINES,
+    BlackFormatter,
+    _format_batch,
+    _format_source,
+    _grammar_is_cached,
+    apply_edits,
+    edit_script,
+)
+
+
+def make_info(
+    raw_cell: str,
+    store_history: bool = True,
+    cell_id: t.Optional[str] = None,
+) -> ExecutionInfo:
+    """Build the `ExecutionInfo` that IPython passes to `pre_run_cell`."""
+    return ExecutionInfo(  # type: ignore
+        raw_cell,
+        store_history=store_history,
+        silent=False,
+        shell_futures=True,
+        cell_id=cell_id,
+    )
+
+
+@pytest.fixture
+def shell() -> MagicMock:
+    """Provide a fake ipykernel shell that allows stdin like a frontend."""
+    ip = MagicMock()
+    ip.kernel = SimpleNamespace(_allow_stdin=True)
+    return ip
+
+
+def test_formats_interactive_cell(shell: MagicMock) -> None:
+    """Cells run from a frontend should be replaced with formatted code."""
+    formatter = BlackFormatter(shell)
+    formatter._format_cell(make_info("print('foo')"))
+    shell.set_next_input.assert_called_once_with('print("foo")', replace=True)
+
+
+@pytest.mark.parametrize(
+    "kwargs,allow_stdin,store_history",
+    [
+        ({}, False, True),
+        ({}, True, False),
+        ({"interactive": False}, True, True),
+    ],
+)
+def test_skips_noninteractive_cell(
+    shell: MagicMock,
+    kwargs: t.Dict[str, t.Any],
+    allow_stdin: bool,
+    store_history: bool,
+) -> None:
+    """Headless execution (e.g. papermill) shouldn't pay for formatting."""
+    shell.kernel._allow_stdin = allow_stdin
+    formatter = BlackFormatter(shell, **kwargs)
+    formatter._format_cell(
+        make_info("print('foo')", store_history=store_history)
+    )
+    shell.set_next_input.assert_not_called()
+
+
+def test_interactive_overrides_detection(shell: MagicMock) -> None:
+    """`interactive=True` should format even without stdin."""
+    shell.kernel._allow_stdin = False
+    formatter = BlackFormatter(shell, interactive=True)
+    formatter._format_cell(make_info("print('foo')"))
+    shell.set_next_input.assert_called_once_with('print("foo")', replace=True)
+
+
+@pytest.mark.parametrize(
+    "old,new",
+    [
+        ("x=1", "x = 1"),
+        ("a\nb\nc", "a\nB\nc"),
+        ("a\nb\nc\nd", "a\nc"),
+        ("a\nb", "a\nx\ny\nb"),
+        ("", "x = 1"),
+        ("def f(): pass\nx=1\n\n\n", "def f():\n    pass\n\n\nx = 1"),
+    ],
+)
+def test_edit_script(old: str, new: str) -> None:
+    """Applying the edit script should reproduce the formatted cell."""
+    assert apply_edits(old, edit_script(old, new)) == new
+
+
+def test_patch_through_comm(shell: MagicMock) -> None:
+    """Frontends with an open comm should get edits instead of the cell."""
+    shell.parent_header = {"header": {"session": "abc"}}
+    comm = MagicMock()
+    formatter = BlackFormatter(shell)
+    formatter._open_comm(comm, {"header": {"session": "abc"}})
+
+    source = "print('foo')\nimport os\nx=1"
+    formatter._format_cell(make_info(source, cell_id="cell-1"))
+    shell.set_next_input.assert_not_called()
+    (payload,), _ = comm.send.call_args
+    assert payload["cell_id"] == "cell-1"
+    assert len(payload["edits"]) == 2
+    expected = 'print("foo")\nimport os\n\nx = 1'
+    assert apply_edits(source, payload["edits"]) == expected
+
+    # Other frontends, and cells without an id, get the whole cell
+    formatter._format_cell(make_info("x=2"))
+    shell.parent_header = {"header": {"session": "other"}}
+    formatter._format_cell(make_info("x=3", cell_id="cell-2"))
+    assert shell.set_next_input.call_count == 2
+    assert comm.send.call_count == 1
+
+    # Closing the comm falls back to the whole cell too
+    (on_close,), _ = comm.on_close.call_args
+    on_close({})
+    shell.parent_header = {"header": {"session": "abc"}}
+    formatter._format_cell(make_info("x=4", cell_id="cell-3"))
+    shell.set_next_input.assert_called_with("x = 4", replace=True)
+
+
+def test_isort_stage(shell: MagicMock) -> None:
+    """Import sorting and black should produce a single replacement."""
+    pytest.importorskip("isort")
+    formatter = BlackFormatter(shell, stages=["isort"])
+    formatter._format_cell(
+        make_info("%matplotlib inline\nimport sys, os\nprint('foo');")
+    )
+    shell.set_next_input.assert_called_once_with(
+        '%matplotlib inline\nimport os\nimport sys\n\nprint("foo");',
+        replace=True,
+    )
+
+
+def test_unknown_stage() -> None:
+    """Misspelled stages should fail loudly rather than silently."""
+    with pytest.raises(ValueError):
+        BlackFormatter(None, stages=["isrot"])
+
+
+def test_idle_release(shell: MagicMock) -> None:
+    """Caches should be released when idle and rebuilt on the next cell."""
+    formatter = BlackFormatter(shell, idle_timeout=0.05)
+    formatter._format_cell(make_info("print('foo')"))
+    assert formatter._cache._data
+    deadline = time.monotonic() + 5
+    while formatter._cache._data and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not formatter._cache._data
+
+    formatter._format_cell(make_info("print('bar')"))
+    shell.set_next_input.assert_called_with('print("bar")', replace=True)
+    assert formatter._cache._data
+
+    formatter.configure()
+    assert formatter._idle_timer is None
+
+
+def test_unload_cancels_idle_release(shell: MagicMock) -> None:
+    """Unloading should cancel a pending release of the caches."""
+    shell.events = EventManager(shell, available_events)
+    load(ip=shell, idle_timeout=60)
+    (callback,) = shell.events.callbacks["pre_run_cell"]
+    formatter = callback.__self__
+    shell.events.trigger("pre_run_cell", make_info("x = 1"))
+    timer = formatter._idle_timer
+    assert timer is not None
+
+    unload_ipython_extension(shell)
+    assert formatter._idle_timer is None
+    assert formatter.idle_timeout is None
+    timer.join(timeout=5)
+    assert not timer.is_alive()
+
+
+def test_load_twice(shell: MagicMock) -> None:
+    """Loading again should reconfigure rather than register a second hook."""
+    shell.events = EventManager(shell, available_events)
+    source = "foo(aaaaaaaaaa, bbbbbbbbbb, cccccccccc)"
+    try:
+        load(ip=shell, stages=[lambda source, mode: source])
+        load(ip=shell, line_length=20)
+        assert len(shell.events.callbacks["pre_run_cell"]) == 1
+        (callback,) = shell.events.callbacks["pre_run_cell"]
+        assert callback.__self__.stages == ()
+        shell.events.trigger("pre_run_cell", make_info(source))
+    finally:
+        unload_ipython_extension(shell)
+    shell.set_next_input.assert_called_once_with(
+        "foo(\n    aaaaaaaaaa,\n    bbbbbbbbbb,\n    cccccccccc,\n)",
+        replace=True,
+    )
+    assert not shell.events.callbacks["pre_run_cell"]
+
+
+def test_lookahead(shell: MagicMock) -> None:
+    """Queued execute requests should be formatted before their turn."""
+    zmq = pytest.importorskip("zmq")
+    session_module = pytest.importorskip("jupyter_client.session")
+    session = session_module.Session(key=b"secret")
+    received: t.List[t.Any] = []
+    stream = SimpleNamespace(_recv_callback=None)
+    shell.kernel.shell_stream = stream
+    shell.kernel.session = session
+    shell.events = EventManager(shell, available_events)
+
+    msg = session.msg(
+        "execute_request",
+        content={"code": "x=1", "store_history": True, "allow_stdin": True},
+    )
+    frames = [zmq.Frame(part) for part in session.serialize(msg)]
+    try:
+        # Like from a startup file, before the kernel listens for messages
+        load(ip=shell, lookahead=True)
+        (callback,) = shell.events.callbacks["pre_run_cell"]
+        formatter = callback.__self__
+        stream._recv_callback = received.append
+        shell.events.trigger("pre_run_cell", make_info("y = 2"))
+        assert stream._recv_callback != received.append
+
+        stream._recv_callback(frames)
+        assert received == [frames]
+        formatter._lookahead_executor.submit(lambda: None).result()
+        assert formatter._cache.get(("x=1", *formatter._settings)) == "x = 1"
+
+        # Like ipykernel, a request without `allow_stdin` is headless
+        headless = session.msg(
+            "execute_request",
+            content={"code": "z=3", "store_history": True},
+        )
+        stream._recv_callback(
+            [zmq.Frame(part) for part in session.serialize(headless)]
+        )
+        formatter._lookahead_executor.submit(lambda: None).result()
+        assert formatter._cache.get(("z=3", *formatter._settings)) is None
+
+        # Peeking mustn't stop the kernel from accepting the message
+        _, parts = session.feed_identities(frames, copy=False)
+        session.deserialize(parts, copy=False)
+
+        shell.events.trigger("pre_run_cell", make_info("x=1"))
+    finally:
+        unload_ipython_extension(shell)
+    shell.set_next_input.assert_called_once_with("x = 1", replace=True)
+    assert stream._recv_callback == received.append
+
+
+def test_format_cells() -> None:
+    """The batch API should format valid cells and leave the rest alone."""
+    sources = ["print('foo')", "%%time\nx=1", "print(", "print('foo')", ""]
+    expected = ['print("foo")', "%%time\nx = 1", "print(", 'print("foo")', ""]
+    assert format_cells(sources) == expected
+    assert format_cells(sources, workers=2) == expected
+
+
+def test_format_cells_beyond_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Cells evicted from the cache shouldn't be formatted a second time."""
+    mode = black.Mode(target_versions={black.TargetVersion.PY310})
+    formatter = BlackFormatter(None, mode=mode)
+    formatter._cache.maxsize = 2
+    monkeypatch.setattr(
+        "jupyter_black.jupyter_black._format_source", MagicMock()
+    )
+    sources = [f"x_{i}={i}" for i in range(10)]
+    expected = [f"x_{i} = {i}" for i in range(10)]
+    assert formatter.format_cells(sources) == expected
+
+
+@pytest.mark.parametrize("engine", ["auto", *ENGINES])
+def test_format_cells_engines(engine: str) -> None:
+    """Every engine, or its fallback, should match serial formatting."""
+    sources = [f"x_{i}={i}" for i in range(BATCH_SIZE + 1)]
+    expected = [f"x_{i} = {i}" for i in range(BATCH_SIZE + 1)]
+    assert format_cells(sources, workers=2, engine=engine) == expected
+
+
+def test_unknown_engine() -> None:
+    """Misspelled engines should fail loudly rather than silently."""
+    with pytest.raises(ValueError):
+        format_cells(["x=1"] * (BATCH_SIZE + 1), workers=2, engine="fork")
+
+
+def test_format_cells_mode() -> None:
+    """An explicit mode should take precedence over pyproject.toml."""
+    source = "foo(aaaaaaaaaa, bbbbbbbbbb, cccccccccc)"
+    (formatted,) = format_cells([source], mode=black.Mode(line_length=20))
+    assert (
+        formatted
+        == "foo(\n    aaaaaaaaaa,\n    bbbbbbbbbb,\n    cccccccccc,\n)"
+    )
+
+
+def test_format_batch_matches_per_cell() -> None:
+    """Batching must give exactly the same result as formatting each cell."""
+    sources = [
+        "import os",
+        "def f(): pass",
+        "# comment\ndef g(): pass",
+        "\n\nx  =  2\n\n",
+        "class A:\n  x=1",
+        "for i in range(3):\n    print(i)",
+        "x=1\n# trailing comment",
+        '"""docstring"""\nx=1',
+        "x=1;",
+        "%%time\nx=1",
+        "print(",
+        "@dec\ndef h(): pass",
+        "a = 1\n\n\n\nb = 2",
+        # Features used by one cell mustn't change how others are formatted
+        "match x:\n    case 1:\n        pass",
+        f"with open('{'a' * 24}') as f, open('{'b' * 31}') as g, "
+        "open('c') as h:\n    pass",
+    ]
+    modes = [
+        black.Mode(is_ipynb=True),
+        black.Mode(is_ipynb=True, target_versions={black.TargetVersion.PY310}),
+    ]
+    for mode in modes:
+        for i in range(len(sources)):
+            rotated = sources[i:] + sources[:i]
+            expected = [_format_source(source, mode) for source in rotated]
+            assert _format_batch(rotated, mode) == expected
+
+
+def test_preprocessor() -> None:
+    """The nbconvert preprocessor should only format code cells."""
+    nbformat = pytest.importorskip("nbformat")
+    pytest.importorskip("nbconvert")
+    from jupyter_black.preprocessor import BlackPreprocessor
+
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell("print('foo')"),
+        nbformat.v4.new_markdown_cell("print('foo')"),
+    ]
+    preprocessor = BlackPreprocessor(enabled=True)  # type: ignore
+    nb, _ = preprocessor(nb, {})
+    assert nb.cells[0].source == 'print("foo")'
+    assert nb.cells[1].source == "print('foo')"
+
+
+def test_prewarm_cli(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture,
+) -> None:
+    """`python -m jupyter_black --prewarm` should cache the grammar tables."""
+    # Work on a copy of black's grammar files rather than site-packages
+    grammar_dir = os.path.dirname(pygram.__file__)
+    for name in ("Grammar.txt", "PatternGrammar.txt"):
+        shutil.copy(os.path.join(grammar_dir, name), tmp_path)
+    monkeypatch.setattr(pygram, "__file__", str(tmp_path / "pygram.py"))
+
+    assert not _grammar_is_cached()
+    assert main(["--prewarm"]) == 0
+    assert _grammar_is_cached()
+    assert str(tmp_path) in capsys.readouterr().out
+
+    # Kernels may run as a different user than the one who ran --prewarm
+    pickles = list(tmp_path.glob("*.pickle"))
+    assert len(pickles) == 2
+    for pickle in pickles:
+        assert pickle.stat().st_mode & 0o777 == 0o644
@@ -75,7 +75,7 @@ def test_bad_config() -> None:
     mock = MagicMock(return_value=f"{Path(__file__).parent}/pyproject.toml")
     with patch("black.find_pyproject_toml", mock):
         try:
-            formatter = BlackFormatter(None)  # type: ignore
+            formatter = BlackFormatter(None)
         except TypeError as e:
             pytest.fail(f"Failed to instantiate formatter: {e}")
     assert formatter.mode.line_length == 42